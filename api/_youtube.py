@@ -1,12 +1,98 @@
+import hashlib
 import os
 import re
+import threading
 import urllib.parse
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
+import ijson  # type: ignore[import-untyped]
+import msgspec
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 YOUTUBE_API_BASE = "https://www.googleapis.com/youtube/v3"
 
+# Upper bound on concurrent comments.list requests, to stay under YouTube quota
+MAX_REPLY_FETCH_WORKERS = 10
+_REPLY_POOL = ThreadPoolExecutor(max_workers=MAX_REPLY_FETCH_WORKERS)
+
+# Shared keep-alive session: upstream calls reuse pooled TLS connections
+# instead of handshaking per request
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]),
+    ),
+)
+
+# Normalized fetch_comment_threads results plus their encoded response, reused
+# while warm; popular videos are polled by many clients with identical queries.
+# The TTL outlives the max-age the comments endpoint advertises, so clients that
+# revalidate once their copy goes stale still find the entry (and its ETag).
+THREADS_CACHE_TTL = 60
+_ThreadsKey = Tuple[str, str, int, Optional[str], bool, int]
+_THREADS_CACHE: "TTLCache[_ThreadsKey, CachedCommentThreads]" = TTLCache(
+    maxsize=1024, ttl=THREADS_CACHE_TTL
+)
+_THREADS_CACHE_LOCK = threading.Lock()
+
+# Shared read-only fallback for missing sub-objects in API responses; never mutate
+_EMPTY: Dict[str, Any] = {}
+
+_EMBED_RE = re.compile(r"/embed/([A-Za-z0-9_-]{11})")
+# Only accept an id delimited like a path segment or query value, so that
+# slices of other tokens (attribution_link, channel names) are not mistaken for ids
+_ID_RE = re.compile(r"(?:/|v=|vi=|%3D)([0-9A-Za-z_-]{11})(?:[?&#%]|$)")
+# Every byte a video id may contain; bytes.translate(None, _ID_CHARS) deletes
+# them in one C-level table pass, so anything left over marks an invalid id
+_ID_CHARS = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-"
+
+
+# Response payload types. Field names are the JSON keys; msgspec encodes these
+# straight to bytes without building intermediate dicts. None of them can form
+# reference cycles, so they are excluded from GC tracking.
+class Comment(msgspec.Struct, gc=False):
+    id: Optional[str]
+    text: Optional[str]
+    author: Optional[str]
+    authorChannelId: Optional[str]
+    publishedAt: Optional[str]
+    updatedAt: Optional[str]
+    likeCount: int
+    isReply: bool
+    parentId: Optional[str]
+
+
+class CommentThread(msgspec.Struct, gc=False):
+    threadId: Optional[str]
+    topLevelComment: Comment
+    replyCount: int
+    replies: List[Comment]
+
+
+class CommentThreadsPage(msgspec.Struct, gc=False):
+    videoId: str
+    nextPageToken: Optional[str]
+    threads: List[CommentThread]
+
+
+class CachedCommentThreads(msgspec.Struct, gc=False):
+    page: CommentThreadsPage
+    # The page encoded as the JSON response body, and a weak ETag of it
+    payload: bytes
+    etag: str
+    # payload gzip-compressed, filled in by the first response that needs it
+    gzipped: Optional[bytes] = None
+
+
+_encode = msgspec.json.Encoder().encode
+
 
 def get_env_api_key() -> str:
     api_key = os.environ.get("YOUTUBE_API_KEY", "").strip()
@@ -17,27 +103,69 @@ def get_env_api_key() -> str:
     return api_key
 
 
+_YT_NETLOCS = frozenset(
+    {
+        "youtube.com",
+        "www.youtube.com",
+        "m.youtube.com",
+        "music.youtube.com",
+        "youtube-nocookie.com",
+        "www.youtube-nocookie.com",
+    }
+)
+_SHORT_PREFIX = "https://youtu.be/"
+_WATCH_MARKER = "watch?v="
+_ID_TERMINATORS = "?&#/"
+
+
+def is_valid_video_id(s: str) -> bool:
+    return len(s) == 11 and s.isascii() and not s.encode("ascii").translate(None, _ID_CHARS)
+
+
+def _id_at(url: str, i: int) -> Optional[str]:
+    # The 11 chars at url[i:] if they form an id that ends there
+    vid = url[i:i + 11]
+    if is_valid_video_id(vid) and (len(url) == i + 11 or url[i + 11] in _ID_TERMINATORS):
+        return vid
+    return None
+
+
 def extract_video_id_from_url(url: str) -> Optional[str]:
+    # A bare video id rather than a URL
+    if len(url) == 11 and is_valid_video_id(url):
+        return url
+    # Fast paths for the two overwhelmingly common shapes
+    if url.startswith(_SHORT_PREFIX):
+        vid = _id_at(url, len(_SHORT_PREFIX))
+        if vid:
+            return vid
+    i = url.find(_WATCH_MARKER)
+    if i != -1:
+        vid = _id_at(url, i + len(_WATCH_MARKER))
+        if vid:
+            return vid
+
     try:
         parsed = urllib.parse.urlparse(url)
-        if parsed.netloc in {"youtu.be"}:
-            # Short link: https://youtu.be/<id>
-            vid = parsed.path.lstrip("/")
-            return vid or None
-        if parsed.netloc.endswith("youtube.com"):
-            qs = urllib.parse.parse_qs(parsed.query)
-            if "v" in qs and qs["v"]:
-                return qs["v"][0]
-            # Embedded or share formats
-            match = re.search(r"/embed/([A-Za-z0-9_-]{11})", parsed.path)
-            if match:
-                return match.group(1)
-        # As a fallback, try to match a plausible 11-char id in the URL
-        match = re.search(r"([A-Za-z0-9_-]{11})", url)
+    except ValueError:
+        # e.g. an unbalanced "[" in the netloc
+        return None
+    if parsed.netloc == "youtu.be":
+        # Short link: https://youtu.be/<id>
+        vid = parsed.path.lstrip("/").split("/", 1)[0]
+        return vid if is_valid_video_id(vid) else None
+    if parsed.netloc in _YT_NETLOCS:
+        qs = urllib.parse.parse_qs(parsed.query)
+        if "v" in qs and is_valid_video_id(qs["v"][0]):
+            return qs["v"][0]
+        # Embedded or share formats
+        match = _EMBED_RE.search(parsed.path)
         if match:
             return match.group(1)
-    except Exception:
-        pass
+    # As a fallback, try to match a delimited 11-char id anywhere in the URL
+    match = _ID_RE.search(url)
+    if match:
+        return match.group(1)
     return None
 
 
@@ -50,9 +178,95 @@ def normalize_params(max_results: Optional[int], order: Optional[str]) -> Tuple[
 
 
 def _http_get(endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
-    resp = requests.get(endpoint, params=params, timeout=15)
+    resp = _SESSION.get(endpoint, params=params, timeout=15)
     resp.raise_for_status()
-    return resp.json()
+    data: Dict[str, Any] = resp.json()
+    return data
+
+
+def _http_stream(
+    endpoint: str, params: Dict[str, Any], meta: Dict[str, Any]
+) -> Iterator[Dict[str, Any]]:
+    """Yield each element of the response's "items" array as it is parsed.
+
+    Top-level scalar fields (e.g. nextPageToken) are stored into ``meta``;
+    read them only after the generator is exhausted.
+
+    This trades CPU for memory: the event loop and ObjectBuilder run in Python,
+    about 5x the cost of json.loads on a full 100-reply page, to avoid holding
+    that page (~100 KB) at once. ijson.items() would build items in C but
+    cannot also report nextPageToken, whose position in the object is not
+    guaranteed.
+    """
+    with _SESSION.get(endpoint, params=params, timeout=15, stream=True) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        builder = None
+        # ijson yields integers as int already; use_float only turns non-integer
+        # numbers into float instead of Decimal, which msgspec encodes as a string
+        for prefix, event, value in ijson.parse(resp.raw, use_float=True):
+            if prefix == "items.item" and event == "start_map":
+                builder = ijson.ObjectBuilder()
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == "items.item" and event == "end_map":
+                    yield builder.value
+                    builder = None
+            elif "." not in prefix and event in ("string", "number"):
+                meta[prefix] = value
+
+
+def _normalize_reply(r: Dict[str, Any]) -> Comment:
+    rs = r.get("snippet") or _EMPTY
+    get = rs.get
+    return Comment(
+        id=r.get("id"),
+        text=get("textDisplay"),
+        author=get("authorDisplayName"),
+        authorChannelId=(get("authorChannelId") or _EMPTY).get("value"),
+        publishedAt=get("publishedAt"),
+        updatedAt=get("updatedAt"),
+        likeCount=get("likeCount", 0),
+        isReply=True,
+        parentId=get("parentId"),
+    )
+
+
+def _fetch_all_replies(
+    replies: List[Comment], parent_id: str, api_key: str, max_replies: int
+) -> None:
+    """Replace ``replies`` in place with up to ``max_replies`` from comments.list.
+
+    comments.list pages start from the first reply and already include the
+    ones commentThreads returned inline, so pagination starts from scratch
+    instead of skipping those and paying for them twice in page sizes.
+    ``replies`` is left as-is when comments.list returns nothing.
+    """
+    fetched: List[Comment] = []
+    next_token = None
+    # Ex-live videos can hand back nextPageToken cycles; never follow a token twice
+    seen_tokens: Set[str] = set()
+    while len(fetched) < max_replies:
+        limit = min(100, max_replies - len(fetched))
+        rp = {
+            "part": "snippet",
+            "parentId": parent_id,
+            "maxResults": limit,
+            "textFormat": "plainText",
+            "key": api_key,
+        }
+        if next_token:
+            rp["pageToken"] = next_token
+        meta: Dict[str, Any] = {}
+        before = len(fetched)
+        fetched.extend(map(_normalize_reply, _http_stream(f"{YOUTUBE_API_BASE}/comments", rp, meta)))
+        next_token = meta.get("nextPageToken")
+        if not next_token or len(fetched) == before or next_token in seen_tokens:
+            break
+        seen_tokens.add(next_token)
+    # An empty result (e.g. an empty first page) must not discard the inline replies
+    if fetched:
+        replies[:] = fetched[:max_replies]
 
 
 def fetch_comment_threads(
@@ -63,10 +277,65 @@ def fetch_comment_threads(
     order: str = "relevance",
     include_replies: bool = False,
     max_replies_per_thread: int = 20,
-) -> Dict[str, Any]:
+) -> CommentThreadsPage:
+    return fetch_comment_threads_cached(
+        video_id,
+        api_key,
+        max_results=max_results,
+        page_token=page_token,
+        order=order,
+        include_replies=include_replies,
+        max_replies_per_thread=max_replies_per_thread,
+    ).page
+
+
+def fetch_comment_threads_cached(
+    video_id: str,
+    api_key: str,
+    max_results: int = 20,
+    page_token: Optional[str] = None,
+    order: str = "relevance",
+    include_replies: bool = False,
+    max_replies_per_thread: int = 20,
+) -> CachedCommentThreads:
+    key: _ThreadsKey = (video_id, order, max_results, page_token, include_replies, max_replies_per_thread)
+    with _THREADS_CACHE_LOCK:
+        cached = _THREADS_CACHE.get(key)
+    if cached is not None:
+        return cached
+    page = _fetch_comment_threads_uncached(
+        video_id,
+        api_key,
+        max_results=max_results,
+        page_token=page_token,
+        order=order,
+        include_replies=include_replies,
+        max_replies_per_thread=max_replies_per_thread,
+    )
+    payload = _encode(page)
+    result = CachedCommentThreads(
+        page=page,
+        payload=payload,
+        etag='W/"%s"' % hashlib.blake2b(payload, digest_size=16).hexdigest(),
+    )
+    with _THREADS_CACHE_LOCK:
+        _THREADS_CACHE[key] = result
+    return result
+
+
+def _fetch_comment_threads_uncached(
+    video_id: str,
+    api_key: str,
+    max_results: int = 20,
+    page_token: Optional[str] = None,
+    order: str = "relevance",
+    include_replies: bool = False,
+    max_replies_per_thread: int = 20,
+) -> CommentThreadsPage:
     # Fetch commentThreads (top-level comments)
     params = {
-        "part": "snippet,replies",
+        # The "replies" part costs quota and payload; only ask for it when it is used
+        "part": "snippet,replies" if include_replies else "snippet",
         "videoId": video_id,
         "maxResults": max_results,
         "order": order,
@@ -81,95 +350,65 @@ def fetch_comment_threads(
     items = data.get("items", [])
     next_page_token = data.get("nextPageToken")
 
-    normalized_threads: List[Dict[str, Any]] = []
+    max_replies = max(0, max_replies_per_thread)
+    normalized_threads: List[CommentThread] = []
+    pending: List[Tuple[List[Comment], str]] = []
 
     for item in items:
-        snippet = item.get("snippet", {})
-        top = snippet.get("topLevelComment", {}).get("snippet", {})
+        snippet = item.get("snippet") or _EMPTY
+        top_level = snippet.get("topLevelComment") or _EMPTY
+        top = top_level.get("snippet") or _EMPTY
         thread_id = item.get("id")
         reply_count = snippet.get("totalReplyCount", 0)
 
-        top_comment = {
-            "id": snippet.get("topLevelComment", {}).get("id"),
-            "text": top.get("textDisplay"),
-            "author": top.get("authorDisplayName"),
-            "authorChannelId": (top.get("authorChannelId") or {}).get("value"),
-            "publishedAt": top.get("publishedAt"),
-            "updatedAt": top.get("updatedAt"),
-            "likeCount": top.get("likeCount", 0),
-            "isReply": False,
-            "parentId": None,
-        }
+        top_comment = Comment(
+            id=top_level.get("id"),
+            text=top.get("textDisplay"),
+            author=top.get("authorDisplayName"),
+            authorChannelId=(top.get("authorChannelId") or _EMPTY).get("value"),
+            publishedAt=top.get("publishedAt"),
+            updatedAt=top.get("updatedAt"),
+            likeCount=top.get("likeCount", 0),
+            isReply=False,
+            parentId=None,
+        )
 
-        replies_payload: List[Dict[str, Any]] = []
-
-        # Replies included inline are limited; optionally fetch full replies
-        inline_replies = (item.get("replies") or {}).get("comments") or []
-        for r in inline_replies:
-            rs = r.get("snippet", {})
-            replies_payload.append(
-                {
-                    "id": r.get("id"),
-                    "text": rs.get("textDisplay"),
-                    "author": rs.get("authorDisplayName"),
-                    "authorChannelId": (rs.get("authorChannelId") or {}).get("value"),
-                    "publishedAt": rs.get("publishedAt"),
-                    "updatedAt": rs.get("updatedAt"),
-                    "likeCount": rs.get("likeCount", 0),
-                    "isReply": True,
-                    "parentId": rs.get("parentId"),
-                }
-            )
+        replies_payload: List[Comment] = []
 
-        if include_replies and reply_count and len(replies_payload) < reply_count:
-            # Fetch remaining replies via comments.list
-            parent_id = top_comment["id"]
-            fetched = 0
-            next_token = None
-            while fetched < max_replies_per_thread:
-                limit = min(100, max_replies_per_thread - fetched)
-                rp = {
-                    "part": "snippet",
-                    "parentId": parent_id,
-                    "maxResults": limit,
-                    "textFormat": "plainText",
-                    "key": api_key,
-                }
-                if next_token:
-                    rp["pageToken"] = next_token
-                rdata = _http_get(f"{YOUTUBE_API_BASE}/comments", rp)
-                ritems = rdata.get("items", [])
-                for r in ritems:
-                    rs = r.get("snippet", {})
-                    replies_payload.append(
-                        {
-                            "id": r.get("id"),
-                            "text": rs.get("textDisplay"),
-                            "author": rs.get("authorDisplayName"),
-                            "authorChannelId": (rs.get("authorChannelId") or {}).get("value"),
-                            "publishedAt": rs.get("publishedAt"),
-                            "updatedAt": rs.get("updatedAt"),
-                            "likeCount": rs.get("likeCount", 0),
-                            "isReply": True,
-                            "parentId": rs.get("parentId"),
-                        }
-                    )
-                fetched += len(ritems)
-                next_token = rdata.get("nextPageToken")
-                if not next_token or not ritems:
-                    break
+        if include_replies:
+            # Replies included inline are limited; fetch the rest if there are more
+            inline_replies = (item.get("replies") or _EMPTY).get("comments") or ()
+            replies_payload.extend(map(_normalize_reply, inline_replies))
+            del replies_payload[max_replies:]
+
+            # Inline replies that already cover the thread (or the budget) need no
+            # call; otherwise the full list is fetched below, once every thread is
+            # known. Without a top-level comment id there is no parent to page by.
+            parent_id = top_comment.id
+            if parent_id and len(replies_payload) < min(reply_count, max_replies):
+                pending.append((replies_payload, parent_id))
 
         normalized_threads.append(
-            {
-                "threadId": thread_id,
-                "topLevelComment": top_comment,
-                "replyCount": reply_count,
-                "replies": replies_payload,
-            }
+            CommentThread(
+                threadId=thread_id,
+                topLevelComment=top_comment,
+                replyCount=reply_count,
+                replies=replies_payload,
+            )
         )
 
-    return {
-        "videoId": video_id,
-        "nextPageToken": next_page_token,
-        "threads": normalized_threads,
-    }
+    # Fetch remaining replies via comments.list, paginating all threads concurrently
+    if pending:
+        # list() waits for every thread and re-raises the first fetch error
+        list(
+            _REPLY_POOL.map(
+                lambda p: _fetch_all_replies(p[0], p[1], api_key, max_replies),
+                pending,
+            )
+        )
+
+    return CommentThreadsPage(
+        videoId=video_id,
+        nextPageToken=next_page_token,
+        threads=normalized_threads,
+    )
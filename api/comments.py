@@ -1,44 +1,119 @@
 from http.server import BaseHTTPRequestHandler
-import json
+import gzip
 import urllib.parse
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+
+import msgspec
 
 from ._youtube import (
+    CachedCommentThreads,
     extract_video_id_from_url,
-    fetch_comment_threads,
+    fetch_comment_threads_cached,
     get_env_api_key,
+    is_valid_video_id,
     normalize_params,
 )
 
 
+_TRUTHY = frozenset({"1", "true", "yes", "on"})
+
+
 def _parse_query(path: str) -> Dict[str, Any]:
-    parsed = urllib.parse.urlparse(path)
-    qs = urllib.parse.parse_qs(parsed.query)
-    def get_one(name: str) -> str:
-        v = qs.get(name)
-        return v[0] if v else ""
+    qs: Dict[str, str] = {}
+    for name, value in urllib.parse.parse_qsl(urllib.parse.urlsplit(path).query):
+        # First occurrence wins, as with parse_qs()[name][0]
+        qs.setdefault(name, value)
+    max_results = qs.get("maxResults")
+    max_replies = qs.get("maxRepliesPerThread")
     return {
-        "url": get_one("url").strip(),
-        "videoId": get_one("videoId").strip(),
-        "pageToken": get_one("pageToken").strip() or None,
-        "order": get_one("order").strip() or None,
-        "includeReplies": (get_one("includeReplies").lower() in {"1","true","yes","on"}),
-        "maxResults": int(get_one("maxResults")) if get_one("maxResults") else None,
-        "maxRepliesPerThread": int(get_one("maxRepliesPerThread")) if get_one("maxRepliesPerThread") else 20,
+        "url": qs.get("url", "").strip(),
+        "videoId": qs.get("videoId", "").strip(),
+        "pageToken": qs.get("pageToken", "").strip() or None,
+        "order": qs.get("order", "").strip() or None,
+        "includeReplies": qs.get("includeReplies", "").lower() in _TRUTHY,
+        "maxResults": int(max_results) if max_results else None,
+        "maxRepliesPerThread": int(max_replies) if max_replies else 20,
     }
 
 
+# Comment threads rarely change within seconds; let clients and CDNs reuse them
+# briefly. max-age stays below THREADS_CACHE_TTL so revalidations hit the cache.
+CACHE_CONTROL_OK = "public, max-age=30, stale-while-revalidate=60"
+
+# Smaller bodies are not worth the gzip framing and CPU
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison (RFC 9110 13.1.2): ignore the W/ prefix on either side
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == opaque:
+            return True
+    return False
+
+
+_encode = msgspec.json.Encoder().encode
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    # An explicit gzip entry takes precedence over "*", wherever each appears;
+    # q=0 (with any number of zero decimals) refuses the coding it applies to
+    allowed: Dict[str, bool] = {}
+    for coding in accept_encoding.lower().split(","):
+        name, _, params = coding.partition(";")
+        name = name.strip()
+        if name in {"gzip", "*"}:
+            weight = ""
+            for param in params.split(";"):
+                key, _, value = param.partition("=")
+                if key.strip() == "q":
+                    weight = value.strip()
+            allowed[name] = not weight or weight.strip("0.") != ""
+    if "gzip" in allowed:
+        return allowed["gzip"]
+    return allowed.get("*", False)
+
+
 class handler(BaseHTTPRequestHandler):
-    def _send(self, code: int, body: Dict[str, Any]):
-        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    def _send(self, code: int, body: Any):
+        self._send_payload(code, _encode(body), None)
+
+    def _send_payload(self, code: int, payload: bytes, cached: Optional[CachedCommentThreads]):
+        # ``cached`` is the cache entry ``payload`` came from, if any; it supplies
+        # the ETag and keeps the compressed body so it is only gzipped once
+        etag = cached.etag if cached is not None else None
+        if etag and _etag_matches(self.headers.get("If-None-Match", ""), etag):
+            code, payload = 304, b""
+        gzipped = len(payload) > GZIP_MIN_SIZE and _accepts_gzip(
+            self.headers.get("Accept-Encoding", "")
+        )
+        if gzipped:
+            if cached is None:
+                payload = gzip.compress(payload, GZIP_LEVEL)
+            else:
+                if cached.gzipped is None:
+                    cached.gzipped = gzip.compress(payload, GZIP_LEVEL)
+                payload = cached.gzipped
         self.send_response(code)
-        self.send_header("Content-Type", "application/json; charset=utf-8")
-        self.send_header("Cache-Control", "no-store")
+        if code != 304:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            if gzipped:
+                self.send_header("Content-Encoding", "gzip")
+        self.send_header("Vary", "Accept-Encoding")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", CACHE_CONTROL_OK)
+        else:
+            self.send_header("Cache-Control", "no-store")
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "GET, OPTIONS")
         self.send_header("Access-Control-Allow-Headers", "*")
         self.end_headers()
-        self.wfile.write(payload)
+        if payload:
+            self.wfile.write(payload)
 
     def do_OPTIONS(self):
         self.send_response(204)
@@ -59,6 +134,11 @@ class handler(BaseHTTPRequestHandler):
                 self._send(400, {"error": "Missing 'videoId' or parsable 'url' query param."})
                 return
 
+            # Reject malformed ids here rather than spending an upstream call on them
+            if not is_valid_video_id(video_id):
+                self._send(400, {"error": "Invalid YouTube video id."})
+                return
+
             try:
                 api_key = get_env_api_key()
             except RuntimeError as e:
@@ -67,7 +147,9 @@ class handler(BaseHTTPRequestHandler):
 
             max_results, order = normalize_params(q["maxResults"], q["order"])
 
-            data = fetch_comment_threads(
+            # Served from the in-process cache while warm, so a matching
+            # If-None-Match is answered without an upstream call
+            cached = fetch_comment_threads_cached(
                 video_id=video_id,
                 api_key=api_key,
                 max_results=max_results,
@@ -77,6 +159,6 @@ class handler(BaseHTTPRequestHandler):
                 max_replies_per_thread=q["maxRepliesPerThread"],
             )
 
-            self._send(200, data)
+            self._send_payload(200, cached.payload, cached)
         except Exception as ex:
             self._send(500, {"error": "Internal server error", "details": str(ex)})